@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from collections import namedtuple
+import numpy as np
+from ibm_model1 import NULL
+
+# An integer encoded bitext.
+#   f_ids: the source word ids of every sentence, concatenated
+#   f_starts: f_ids[f_starts[n]:f_starts[n+1]] are the ids of sentence n
+#   e_ids: the target word ids of every sentence, concatenated
+#   e_starts: e_ids[e_starts[n]:e_starts[n+1]] are the ids of sentence n
+encoded_bitext = namedtuple('encoded_bitext', 'f_ids, f_starts, e_ids, e_starts')
+
+
+def word_ids(words, vocab, index):
+    """
+    Maps words to integer ids, adding unseen words to the vocabulary.
+    """
+    ids = []
+    for word in words:
+        if word not in index:
+            index[word] = len(vocab)
+            vocab.append(word)
+        ids.append(index[word])
+    return ids
+
+
+def encode_bitext(bitext, null=True, f_vocab=None, e_vocab=None):
+    """
+    Maps every word of the bitext to an integer id.
+
+    Returns (f_vocab, e_vocab, corpus), where the vocabularies are lists of
+    words indexed by their ids. If null is set, the null token gets id 0 in
+    f_vocab and is prepended to every source sentence of the corpus.
+    Existing vocabularies can be given to keep their ids; words they do not
+    contain get new ids after them.
+    """
+    f_vocab = list(f_vocab or [])
+    e_vocab = list(e_vocab or [])
+    f_index = dict((word, n) for (n, word) in enumerate(f_vocab))
+    e_index = dict((word, n) for (n, word) in enumerate(e_vocab))
+    if null:
+        word_ids([NULL], f_vocab, f_index)
+
+    f_ids, e_ids = array('i'), array('i')
+    f_starts, e_starts = array('l', [0]), array('l', [0])
+    for (f, e) in bitext:
+        if null:
+            f = [NULL] + f
+        f_ids.extend(word_ids(f, f_vocab, f_index))
+        e_ids.extend(word_ids(e, e_vocab, e_index))
+        f_starts.append(len(f_ids))
+        e_starts.append(len(e_ids))
+
+    corpus = encoded_bitext(np.frombuffer(f_ids, dtype=np.int32),
+                            np.array(f_starts, dtype=np.int64),
+                            np.frombuffer(e_ids, dtype=np.int32),
+                            np.array(e_starts, dtype=np.int64))
+    return (f_vocab, e_vocab, corpus)
+
+
+def num_sentences(corpus):
+    return len(corpus.f_starts) - 1
+
+
+def sentence_pairs(corpus, lo, hi):
+    """
+    Lists every (source token, target token) pair of sentences lo to hi - 1.
+    Like a slice, hi may be past the last sentence.
+
+    Token indices point into corpus.f_ids and corpus.e_ids. Pairs are ordered
+    by sentence, then by source position, then by target position.
+    """
+    hi = min(hi, num_sentences(corpus))
+    f_starts = corpus.f_starts[lo:hi + 1]
+    e_starts = corpus.e_starts[lo:hi + 1]
+    f_lens = np.diff(f_starts)
+    e_lens = np.diff(e_starts)
+    sizes = f_lens * e_lens
+
+    sent = np.repeat(np.arange(hi - lo), sizes)
+    pair_starts = np.cumsum(sizes) - sizes
+    local = np.arange(sizes.sum()) - pair_starts[sent]
+    e_len = e_lens[sent]
+    f_tok = f_starts[:-1][sent] + local // e_len
+    e_tok = e_starts[:-1][sent] + local % e_len
+    return (f_tok, e_tok)
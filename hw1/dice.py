@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Word alignment with Dice's coefficient.
+#
+# Words are mapped to integer ids, and the co-occurrence counts are kept in
+# sorted key arrays rather than dictionaries keyed by word tuples. Pairs below
+# the threshold are dropped before aligning, so aligning only searches the
+# small table of pairs that can be aligned.
+
+import sys
+import numpy as np
+from corpus import encode_bitext, encoded_bitext, num_sentences, sentence_pairs
+
+
+def sentence_sets(ids, starts, vocab_size):
+    """
+    Removes repeated words within each sentence. Returns the ids and starts of
+    the sentences' word sets.
+    """
+    sents = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+    keys = np.unique(sents * vocab_size + ids)
+    set_starts = np.searchsorted(keys // vocab_size, np.arange(len(starts)))
+    return ((keys % vocab_size).astype(np.int32), set_starts)
+
+
+def cooccurrence_counts(corpus, num_f, num_e, batch_size=1000):
+    """
+    Counts the sentences that contain each source word, each target word, and
+    each (source, target) pair of words.
+
+    Returns (f_count, e_count, keys, fe_count), where keys are the sorted keys
+    f_id * num_e + e_id of the pairs that co-occur and fe_count their counts.
+    """
+    (f_ids, f_starts) = sentence_sets(corpus.f_ids, corpus.f_starts, num_f)
+    (e_ids, e_starts) = sentence_sets(corpus.e_ids, corpus.e_starts, num_e)
+    sets = encoded_bitext(f_ids, f_starts, e_ids, e_starts)
+    f_count = np.bincount(f_ids, minlength=num_f)
+    e_count = np.bincount(e_ids, minlength=num_e)
+
+    keys = []
+    counts = []
+    n = num_sentences(sets)
+    for lo in xrange(0, n, batch_size):
+        (f_tok, e_tok) = sentence_pairs(sets, lo, min(lo + batch_size, n))
+        pair_keys = f_ids[f_tok].astype(np.int64) * num_e + e_ids[e_tok]
+        (batch_keys, batch_counts) = np.unique(pair_keys, return_counts=True)
+        keys.append(batch_keys)
+        counts.append(batch_counts)
+        sys.stderr.write(".")
+
+    (keys, inverse) = np.unique(np.concatenate(keys), return_inverse=True)
+    fe_count = np.bincount(inverse, weights=np.concatenate(counts))
+    return (f_count, e_count, keys, fe_count)
+
+
+def dice_table(corpus, num_f, num_e, threshold, batch_size=1000):
+    """
+    Computes Dice's coefficient of every co-occurring pair, and returns the
+    sorted keys of the pairs whose coefficient is at least threshold.
+    """
+    (f_count, e_count, keys, fe_count) = cooccurrence_counts(corpus, num_f,
+                                                             num_e, batch_size)
+    dice = 2.0 * fe_count / (f_count[keys // num_e] + e_count[keys % num_e])
+    return keys[dice >= threshold]
+
+
+def dice(bitext, threshold, out, batch_size=1000):
+    """
+    Aligns every pair of words whose Dice's coefficient is at least threshold,
+    writing one line of alignments per sentence to out.
+    """
+    (f_vocab, e_vocab, corpus) = encode_bitext(bitext, null=False)
+    num_e = len(e_vocab)
+    table = dice_table(corpus, len(f_vocab), num_e, threshold, batch_size)
+    sys.stderr.write("\n")
+
+    n = num_sentences(corpus)
+    for lo in xrange(0, n, batch_size):
+        hi = min(lo + batch_size, n)
+        (f_tok, e_tok) = sentence_pairs(corpus, lo, hi)
+        keys = corpus.f_ids[f_tok].astype(np.int64) * num_e + corpus.e_ids[e_tok]
+        aligned = np.zeros(len(keys), dtype=bool)
+        if len(table) > 0:
+            index = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+            aligned = table[index] == keys
+
+        # The sentence of every pair, and the positions of the aligned pairs
+        sizes = (np.diff(corpus.f_starts[lo:hi + 1]) *
+                 np.diff(corpus.e_starts[lo:hi + 1]))
+        sents = np.repeat(np.arange(hi - lo), sizes)[aligned]
+        f_pos = f_tok[aligned] - corpus.f_starts[lo:hi][sents]
+        e_pos = e_tok[aligned] - corpus.e_starts[lo:hi][sents]
+        pairs = zip(f_pos.tolist(), e_pos.tolist())
+
+        pos = 0
+        for count in np.bincount(sents, minlength=hi - lo):
+            out.write("".join("%i-%i " % pair for pair in pairs[pos:pos + count]))
+            out.write("\n")
+            pos += count
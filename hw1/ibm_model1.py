@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
 from collections import defaultdict
+import multiprocessing
 import sys
 
+# The null token that every source sentence can align to.
+NULL = ''
+
 verbose = False
 def vprint(string):
     """
@@ -22,7 +26,7 @@ def prepare_iters(bitext):
     for (n, (f, e)) in enumerate(bitext):
         # We include the null token as an option for a word translation in the
         # source language.
-        f.insert(0, '')
+        f = [NULL] + f
         for (j, f_j) in enumerate(f):
             for (i, e_i) in enumerate(e):
                 # We are assuming that p(e_i | f_j) is uniform.
@@ -42,33 +46,54 @@ def prepare_iters(bitext):
     return compute_pef_probs(f_e_count, f_source_count)
 
 
-def ibm_model1(bitext, me_iters):
-    p_e_f = run_iterations(bitext, me_iters)
+def ibm_model1(bitext, me_iters, workers=None, p_e_f=None, start=0,
+               checkpoint=None):
+    p_e_f = run_iterations(bitext, me_iters, workers, p_e_f, start, checkpoint)
 
     sys.stderr.write("\nGetting most likely alignments...\n")
     alignments = get_max_alignments(bitext, p_e_f)
 
     sys.stderr.write("\nFormatting alignments...\n")
-    # Convert the lines to the string format we need:
-    # That is, "%i-%i" <--- substituting in source index and target index
-    str_alignments = []
-    for sentence_alignment in alignments:
-        align_strings = ['%i-%i' % (align_pair[0], align_pair[1])
-                         for align_pair in sentence_alignment]
-        str_alignments.append(' '.join(align_strings))
+    str_alignments = [format_alignment(sentence_alignment)
+                      for sentence_alignment in alignments]
 
     # append a blank string so we end with a newline
     str_alignments.append('')
     return '\n'.join(str_alignments)
 
 
+def ibm_model1_stream(bitext, me_iters, out, workers=None, p_e_f=None,
+                      start=0, checkpoint=None):
+    """
+    Trains on a bitext that is re-read on every pass, and writes each
+    sentence's alignment to out as soon as it is decoded.
+
+    Apart from the translation table, memory does not grow with the corpus.
+    """
+    p_e_f = run_iterations(bitext, me_iters, workers, p_e_f, start, checkpoint)
+
+    sys.stderr.write("\nGetting most likely alignments...\n")
+    for (n, (f, e)) in enumerate(bitext):
+        sentence_alignment = get_max_sentence_alignment([NULL] + f, e, p_e_f)
+        out.write(format_alignment(sentence_alignment) + '\n')
+        if n % 500 == 0:
+            sys.stderr.write('.')
+
+
+def format_alignment(sentence_alignment):
+    # Convert the alignment to the string format we need:
+    # That is, "%i-%i" <--- substituting in source index and target index
+    return ' '.join(['%i-%i' % (align_pair[0], align_pair[1])
+                     for align_pair in sentence_alignment])
+
+
 def get_max_alignments(bitext, p_e_f):
     """
     Determine the best alignments for sentences.
     """
     alignments = []
     for (n, (f,e)) in enumerate(bitext):
-        sentence_alignment = get_max_sentence_alignment(f, e, p_e_f)
+        sentence_alignment = get_max_sentence_alignment([NULL] + f, e, p_e_f)
         alignments.append(sentence_alignment)
         if n % 500 == 0:
             sys.stderr.write('.')
@@ -76,6 +101,7 @@ def get_max_alignments(bitext, p_e_f):
     return alignments
 
 
+# f starts with the null token.
 def get_max_sentence_alignment(f, e, p_e_f):
     alignments = []
 
@@ -121,7 +147,13 @@ def compute_pef_probs(f_e_expect, f_source_expect):
 
 
 # me_iters is the number of ME iterations we do to improve our probabilities.
-def run_iterations(bitext, me_iters):
+# If workers is set, the expected counts are computed by a pool of that many
+# processes, using the sharded E-step below.
+# Training resumes from p_e_f if it is given, which has already been trained
+# for start iterations. After every iteration, checkpoint(p_e_f, iterations) is
+# called if it is set.
+def run_iterations(bitext, me_iters, workers=None, p_e_f=None, start=0,
+                   checkpoint=None):
     """
     Runs the EM iterations
     """
@@ -132,40 +164,168 @@ def run_iterations(bitext, me_iters):
     #   f_e = number of times source word f aligns to target word e
     #   a_f = number of times that f was used as the translation source word
     # We start out with uniform probabilities for each translation (f_j, e_i).
-    p_e_f = prepare_iters(bitext)
+    if p_e_f is None:
+        p_e_f = prepare_iters(bitext)
+    else:
+        check_coverage(bitext, p_e_f)
     vprint(p_e_f)
     sys.stderr.write('\nDone preparing parameters. Beginning iterations...\n')
 
-    for iterNum in xrange(me_iters):
-        # The expected number of times we translate from a given word f_j to a
-        # given word e_i.
-        f_e_expect = defaultdict(float)
-        f_source_expect = defaultdict(float)
-        # Total expected count of anything translating to e_i
-        total_e = defaultdict(float)
-        # We update the expected counts for the number of translations from f_j
-        # to e_i and the expected number of translations from f_j to any word in
-        # the target language.
-        for (n, (f, e)) in enumerate(bitext):
-            for (i, e_i) in enumerate(e):
-                for (j, f_j) in enumerate(f):
-                    vprint('p_e_f[(' + f_j + ',' + e_i + ')] = ' + str(p_e_f[(f_j, e_i)]))
-                    # Computing the expected values that we use for our
-                    # iterative EM. These expected values are used to give us
-                    # the new p(e_i | f_j) probabilities at the end of each
-                    # iteration.
-                    total_e[e_i] += p_e_f[(f_j, e_i)]
-
-            for (j, f_j) in enumerate(f):
-                for (i, e_i) in enumerate(e):
-                    prob_trans = p_e_f[(f_j, e_i)]
-                    f_e_expect[(f_j, e_i)] += prob_trans / total_e[e_i]
-                    f_source_expect[f_j] += prob_trans / total_e[e_i]
-            if n % 500 == 0:
-                sys.stderr.write('.')
-
-        # Updating the probabilities for translations between words
-        p_e_f = compute_pef_probs(f_e_expect, f_source_expect)
+    for iterNum in xrange(start, me_iters):
+        if workers is not None:
+            p_e_f = sharded_iteration(bitext, p_e_f, workers)
+        else:
+            p_e_f = serial_iteration(bitext, p_e_f)
         sys.stderr.write("Done with iteration " + str(iterNum) + '\n')
+        if checkpoint is not None:
+            checkpoint(p_e_f, iterNum + 1)
 
     return p_e_f
+
+
+def check_coverage(bitext, p_e_f):
+    """
+    Makes sure that every (f_j, e_i) pair of the bitext is in the table.
+    """
+    for (f, e) in bitext:
+        for f_j in [NULL] + f:
+            for e_i in e:
+                if not p_e_f.get((f_j, e_i), 0.0) > 0:
+                    raise ValueError('The model was not trained on this bitext')
+
+
+def serial_iteration(bitext, p_e_f):
+    """
+    Runs one EM iteration
+    """
+    # The expected number of times we translate from a given word f_j to a
+    # given word e_i.
+    f_e_expect = defaultdict(float)
+    f_source_expect = defaultdict(float)
+    # Total expected count of anything translating to e_i
+    total_e = defaultdict(float)
+    # We update the expected counts for the number of translations from f_j
+    # to e_i and the expected number of translations from f_j to any word in
+    # the target language.
+    for (n, (f, e)) in enumerate(bitext):
+        f = [NULL] + f
+        for (i, e_i) in enumerate(e):
+            for (j, f_j) in enumerate(f):
+                vprint('p_e_f[(' + f_j + ',' + e_i + ')] = ' + str(p_e_f[(f_j, e_i)]))
+                # Computing the expected values that we use for our
+                # iterative EM. These expected values are used to give us
+                # the new p(e_i | f_j) probabilities at the end of each
+                # iteration.
+                total_e[e_i] += p_e_f[(f_j, e_i)]
+
+        for (j, f_j) in enumerate(f):
+            for (i, e_i) in enumerate(e):
+                prob_trans = p_e_f[(f_j, e_i)]
+                f_e_expect[(f_j, e_i)] += prob_trans / total_e[e_i]
+                f_source_expect[f_j] += prob_trans / total_e[e_i]
+        if n % 500 == 0:
+            sys.stderr.write('.')
+
+    # Updating the probabilities for translations between words
+    return compute_pef_probs(f_e_expect, f_source_expect)
+
+
+# The number of sentences in each shard of the parallel E-step. Shards do not
+# depend on the number of workers, and their counts are always merged in shard
+# order, so the model is the same for any number of workers.
+# The bitext only needs len() and slicing, so a streamed bitext whose slices
+# are read lazily works as well as a list.
+shard_size = 2000
+
+# The bitext and the current p(e_i | f_j) of the parallel E-step. They are set
+# before the worker pool is forked, so the workers inherit them rather than
+# receiving a pickled copy for every shard.
+shared = {}
+
+
+def shard_bounds(bitext):
+    return [(lo, min(lo + shard_size, len(bitext)))
+            for lo in xrange(0, len(bitext), shard_size)]
+
+
+def shard_totals(bounds):
+    """
+    Sums the expected count of anything translating to e_i over one shard.
+    """
+    (lo, hi) = bounds
+    p_e_f = shared['p_e_f']
+    total_e = defaultdict(float)
+    for (f, e) in shared['bitext'][lo:hi]:
+        f = [NULL] + f
+        for e_i in e:
+            for f_j in f:
+                total_e[e_i] += p_e_f[(f_j, e_i)]
+    return total_e
+
+
+def shard_expect(args):
+    """
+    Computes the expected translation counts of one shard.
+
+    total_e starts out as the totals of all of the earlier shards, so every
+    sentence sees the same running totals as in the serial iteration.
+    """
+    ((lo, hi), total_e) = args
+    p_e_f = shared['p_e_f']
+    total_e = defaultdict(float, total_e)
+    f_e_expect = defaultdict(float)
+    f_source_expect = defaultdict(float)
+    for (f, e) in shared['bitext'][lo:hi]:
+        f = [NULL] + f
+        for e_i in e:
+            for f_j in f:
+                total_e[e_i] += p_e_f[(f_j, e_i)]
+
+        for f_j in f:
+            for e_i in e:
+                prob_trans = p_e_f[(f_j, e_i)]
+                f_e_expect[(f_j, e_i)] += prob_trans / total_e[e_i]
+                f_source_expect[f_j] += prob_trans / total_e[e_i]
+    return (f_e_expect, f_source_expect)
+
+
+def sharded_iteration(bitext, p_e_f, workers):
+    """
+    Runs one EM iteration with the E-step split across worker processes.
+
+    The first pass sums each shard's totals for e_i, which gives every shard
+    the totals it starts from. The second pass computes the expected counts of
+    each shard, which are merged in shard order and normalized.
+    """
+    shared['bitext'] = bitext
+    shared['p_e_f'] = p_e_f
+    bounds = shard_bounds(bitext)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        pool_map = pool.imap
+    else:
+        pool = None
+        pool_map = map
+
+    start_totals = []
+    total_e = defaultdict(float)
+    for (bound, shard_total_e) in zip(bounds, pool_map(shard_totals, bounds)):
+        start_totals.append((bound, dict((e_i, total_e[e_i])
+                                         for e_i in shard_total_e)))
+        for (e_i, total) in shard_total_e.iteritems():
+            total_e[e_i] += total
+
+    f_e_expect = defaultdict(float)
+    f_source_expect = defaultdict(float)
+    for (shard_f_e, shard_f_source) in pool_map(shard_expect, start_totals):
+        for (f_e, expect) in shard_f_e.iteritems():
+            f_e_expect[f_e] += expect
+        for (f_j, expect) in shard_f_source.iteritems():
+            f_source_expect[f_j] += expect
+        sys.stderr.write('.')
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    del shared['bitext'], shared['p_e_f']
+    return compute_pef_probs(f_e_expect, f_source_expect)
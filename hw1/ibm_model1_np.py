@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# An integer indexed, NumPy implementation of IBM Model 1.
+#
+# It trains the same model as ibm_model1.py and produces the same alignments,
+# but the vocabulary is mapped to integer ids once, and the translation table
+# p(e_i | f_j) is held in two parallel arrays instead of a dictionary keyed by
+# word tuples. Every step processes a whole batch of sentences at once.
+
+from collections import namedtuple
+import sys
+import numpy as np
+from corpus import encode_bitext, num_sentences, sentence_pairs
+from ibm_model1 import format_alignment
+
+# A translation table.
+#   keys: the sorted keys f_id * num_e + e_id of every known (f_j, e_i) pair
+#   probs: probs[k] is p(e_i | f_j) for the pair with key keys[k]
+#   num_e: the size of the target vocabulary
+trans_table = namedtuple('trans_table', 'keys, probs, num_e')
+
+
+def pair_keys(f_ids, e_ids, num_e):
+    return f_ids.astype(np.int64) * num_e + e_ids
+
+
+def table_index(table, f_ids, e_ids):
+    """
+    Finds the position of every (f_j, e_i) pair in the translation table.
+    All of the pairs must be in the table.
+    """
+    return np.searchsorted(table.keys, pair_keys(f_ids, e_ids, table.num_e))
+
+
+def table_probs(table, f_ids, e_ids):
+    """
+    Looks up p(e_i | f_j) for every (f_j, e_i) pair, which is 0 for pairs that
+    are not in the translation table.
+    """
+    if len(table.keys) == 0:
+        return np.zeros(len(f_ids))
+    keys = pair_keys(f_ids, e_ids, table.num_e)
+    index = np.minimum(np.searchsorted(table.keys, keys), len(table.keys) - 1)
+    known = (table.keys[index] == keys) & (e_ids < table.num_e)
+    return np.where(known, table.probs[index], 0.0)
+
+
+def check_coverage(corpus, table, batch_size):
+    """
+    Makes sure that every (f_j, e_i) pair of the corpus is in the table.
+    """
+    for (lo, hi) in batches(corpus, batch_size):
+        (f, e, _) = batch_words(corpus, lo, hi)
+        if not (table_probs(table, f, e) > 0).all():
+            raise ValueError('The model was not trained on this bitext')
+
+
+def batches(corpus, batch_size):
+    n = num_sentences(corpus)
+    for lo in xrange(0, n, batch_size):
+        yield (lo, min(lo + batch_size, n))
+
+
+def batch_words(corpus, lo, hi):
+    """
+    Returns the source and target word ids of every pair in sentences lo to
+    hi - 1, along with the target token index of each pair.
+    """
+    (f_tok, e_tok) = sentence_pairs(corpus, lo, hi)
+    return (corpus.f_ids[f_tok], corpus.e_ids[e_tok], e_tok)
+
+
+def prepare_iters(corpus, num_f, num_e, batch_size):
+    """
+    Computes the uniform starting probabilities for p(e_i | f_j).
+    """
+    keys = []
+    counts = []
+    for (lo, hi) in batches(corpus, batch_size):
+        (f, e, _) = batch_words(corpus, lo, hi)
+        (batch_keys, batch_counts) = np.unique(pair_keys(f, e, num_e),
+                                               return_counts=True)
+        keys.append(batch_keys)
+        counts.append(batch_counts)
+        sys.stderr.write('.')
+
+    (keys, inverse) = np.unique(np.concatenate(keys), return_inverse=True)
+    # The number of times that f_j could translate to e_i, and to anything
+    f_e_count = np.bincount(inverse, weights=np.concatenate(counts))
+    f_source_count = np.bincount(keys // num_e, weights=f_e_count,
+                                 minlength=num_f)
+    return compute_pef_probs(trans_table(keys, None, num_e),
+                             f_e_count, f_source_count)
+
+
+def compute_pef_probs(table, f_e_expect, f_source_expect):
+    """
+    Computes all of the probabilities for translations: p(e_i | f_j)
+    """
+    probs = f_e_expect / f_source_expect[table.keys // table.num_e]
+    return table._replace(probs=probs)
+
+
+def segmented_cumsum(values, segments):
+    """
+    Running sums of values that restart whenever the segment id changes.
+    Equal segment ids must be contiguous.
+    """
+    sums = values.copy()
+    k = 1
+    while k < len(sums):
+        same = segments[k:] == segments[:-k]
+        sums[k:] += np.where(same, sums[:-k], 0.0)
+        k *= 2
+    return sums
+
+
+def running_e_totals(corpus, lo, hi, e_tok, probs, total_e):
+    """
+    Computes the total expected count of anything translating to e_i for every
+    pair in sentences lo to hi - 1.
+
+    Like ibm_model1.run_iterations, the totals keep accumulating over the
+    sentences of an iteration: the total used for a sentence includes that
+    sentence and every sentence before it. total_e holds the totals of the
+    earlier batches and is updated in place.
+    """
+    (e_lo, e_hi) = (corpus.e_starts[lo], corpus.e_starts[hi])
+    words = corpus.e_ids[e_lo:e_hi]
+    sents = np.repeat(np.arange(hi - lo), np.diff(corpus.e_starts[lo:hi + 1]))
+    token_probs = np.bincount(e_tok - e_lo, weights=probs,
+                              minlength=e_hi - e_lo)
+
+    # Group the tokens by word and then by sentence, and sum within each word.
+    order = np.lexsort((sents, words))
+    (words, sents) = (words[order], sents[order])
+    running = segmented_cumsum(token_probs[order], words) + total_e[words]
+
+    # The total for a sentence is the running sum at the last token of its
+    # (word, sentence) group.
+    group_end = np.ones(len(order), dtype=bool)
+    group_end[:-1] = (words[1:] != words[:-1]) | (sents[1:] != sents[:-1])
+    group = np.cumsum(group_end) - group_end
+    token_totals = np.empty(len(order))
+    token_totals[order] = running[group_end][group]
+
+    word_end = np.ones(len(order), dtype=bool)
+    word_end[:-1] = words[1:] != words[:-1]
+    total_e[words[word_end]] = running[word_end]
+    return token_totals[e_tok - e_lo]
+
+
+# Training resumes from table if it is given, which has already been trained for
+# start iterations. After every iteration, checkpoint(table, iterations) is
+# called if it is set.
+def run_iterations(corpus, num_f, num_e, me_iters, batch_size=1000, table=None,
+                   start=0, checkpoint=None):
+    """
+    Runs the EM iterations
+    """
+    if table is None:
+        table = prepare_iters(corpus, num_f, num_e, batch_size)
+    else:
+        check_coverage(corpus, table, batch_size)
+    sys.stderr.write('\nDone preparing parameters. Beginning iterations...\n')
+
+    for iterNum in xrange(start, me_iters):
+        f_e_expect = np.zeros(len(table.keys))
+        f_source_expect = np.zeros(num_f)
+        total_e = np.zeros(num_e)
+        for (lo, hi) in batches(corpus, batch_size):
+            (f, e, e_tok) = batch_words(corpus, lo, hi)
+            index = table_index(table, f, e)
+            probs = table.probs[index]
+            weights = probs / running_e_totals(corpus, lo, hi, e_tok, probs,
+                                               total_e)
+            f_e_expect += np.bincount(index, weights=weights,
+                                      minlength=len(f_e_expect))
+            f_source_expect += np.bincount(f, weights=weights,
+                                           minlength=num_f)
+            sys.stderr.write('.')
+
+        table = compute_pef_probs(table, f_e_expect, f_source_expect)
+        sys.stderr.write("Done with iteration " + str(iterNum) + '\n')
+        if checkpoint is not None:
+            checkpoint(table, iterNum + 1)
+
+    return table
+
+
+def get_max_alignments(corpus, table, batch_size=1000):
+    """
+    Determine the best alignments for sentences, yielding one list of
+    (source index, target index) pairs per sentence.
+    """
+    for (lo, hi) in batches(corpus, batch_size):
+        (f, e, _) = batch_words(corpus, lo, hi)
+        probs = table_probs(table, f, e)
+        f_lens = np.diff(corpus.f_starts[lo:hi + 1])
+        e_lens = np.diff(corpus.e_starts[lo:hi + 1])
+        pos = 0
+        for (f_len, e_len) in zip(f_lens, e_lens):
+            if e_len == 0:
+                yield []
+                continue
+            sent_probs = probs[pos:pos + f_len * e_len].reshape(f_len, e_len)
+            pos += f_len * e_len
+            # argmax picks the earliest source word among equally likely ones.
+            # Alignments to the null token (j = 0) are dropped.
+            max_j = sent_probs.argmax(axis=0)
+            max_prob = sent_probs[max_j, np.arange(e_len)]
+            yield [(j - 1, i) for (i, j) in enumerate(max_j)
+                   if j != 0 and max_prob[i] > 0]
+        sys.stderr.write('.')
+
+
+# resume is a (f_vocab, e_vocab, table, iterations) model to continue training.
+# After every iteration, checkpoint(f_vocab, e_vocab, table, iterations) is
+# called if it is set.
+def train(bitext, me_iters, batch_size=1000, resume=None, checkpoint=None):
+    """
+    Encodes the bitext and trains a translation table on it.
+    Returns (corpus, table).
+    """
+    if resume is None:
+        (f_vocab, e_vocab, corpus) = encode_bitext(bitext)
+        (table, start) = (None, 0)
+    else:
+        (f_vocab, e_vocab, table, start) = resume
+        (f_vocab, e_vocab, corpus) = encode_bitext(bitext, True, f_vocab,
+                                                   e_vocab)
+
+    save = None
+    if checkpoint is not None:
+        save = lambda table, iterations: checkpoint(f_vocab, e_vocab, table,
+                                                    iterations)
+    table = run_iterations(corpus, len(f_vocab), len(e_vocab), me_iters,
+                           batch_size, table, start, save)
+    return (corpus, table)
+
+
+def ibm_model1(bitext, me_iters, batch_size=1000, resume=None,
+               checkpoint=None):
+    (corpus, table) = train(bitext, me_iters, batch_size, resume, checkpoint)
+
+    sys.stderr.write("\nGetting most likely alignments...\n")
+    str_alignments = [format_alignment(sentence_alignment)
+                      for sentence_alignment
+                      in get_max_alignments(corpus, table, batch_size)]
+
+    # append a blank string so we end with a newline
+    str_alignments.append('')
+    return '\n'.join(str_alignments)
+
+
+def ibm_model1_stream(bitext, me_iters, out, batch_size=1000, resume=None,
+                      checkpoint=None):
+    """
+    Reads the bitext in a single pass, and writes each sentence's alignment to
+    out as soon as it is decoded. Only the integer encoded corpus is kept.
+    """
+    (corpus, table) = train(bitext, me_iters, batch_size, resume, checkpoint)
+
+    sys.stderr.write("\nGetting most likely alignments...\n")
+    write_alignments(corpus, table, out, batch_size)
+
+
+def align_with_model(bitext, model, out, batch_size=1000):
+    """
+    Aligns a bitext with a trained (f_vocab, e_vocab, table, iterations) model,
+    writing each sentence's alignment to out.
+    """
+    (f_vocab, e_vocab, table, _) = model
+    (_, _, corpus) = encode_bitext(bitext, True, f_vocab, e_vocab)
+    write_alignments(corpus, table, out, batch_size)
+
+
+def write_alignments(corpus, table, out, batch_size=1000):
+    for sentence_alignment in get_max_alignments(corpus, table, batch_size):
+        out.write(format_alignment(sentence_alignment) + '\n')
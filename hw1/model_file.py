@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Binary IBM Model 1 checkpoints.
+#
+# A model file holds the source and target vocabularies and the translation
+# table p(e_i | f_j) as the two arrays of an ibm_model1_np.trans_table:
+#
+#   header: magic, completed iterations, |f vocab|, |e vocab|, number of pairs,
+#           and the byte lengths of the two vocabularies
+#   the source vocabulary, newline separated, in id order
+#   the target vocabulary, newline separated, in id order
+#   padding up to a multiple of 8 bytes
+#   keys: int64 f_id * |e vocab| + e_id of every pair, sorted
+#   probs: float64 p(e_i | f_j) of every pair
+#
+# The arrays are memory-mapped when a model is loaded, so loading only reads
+# the header and the vocabularies.
+
+from collections import defaultdict, namedtuple
+import os
+import struct
+import numpy as np
+from ibm_model1 import NULL
+from ibm_model1_np import trans_table
+
+MAGIC = 'IBM1MDL1'
+HEADER = struct.Struct('<8sIIIQQQ')
+
+# A loaded model.
+#   f_vocab, e_vocab: lists of words indexed by their ids
+#   table: a trans_table whose arrays are memory-mapped from the file
+#   iterations: the number of EM iterations the table has been trained for
+model = namedtuple('model', 'f_vocab, e_vocab, table, iterations')
+
+
+def save_model(filename, f_vocab, e_vocab, table, iterations):
+    """
+    Writes a model file. The file is replaced atomically, so an interrupted
+    run leaves the previous checkpoint intact.
+    """
+    f_words = '\n'.join(f_vocab)
+    e_words = '\n'.join(e_vocab)
+    header = HEADER.pack(MAGIC, iterations, len(f_vocab), len(e_vocab),
+                         len(table.keys), len(f_words), len(e_words))
+    padding = -(len(header) + len(f_words) + len(e_words)) % 8
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as out:
+        out.write(header)
+        out.write(f_words)
+        out.write(e_words)
+        out.write('\0' * padding)
+        out.write(np.asarray(table.keys, dtype='<i8').tostring())
+        out.write(np.asarray(table.probs, dtype='<f8').tostring())
+    os.rename(tmp_filename, filename)
+
+
+def load_model(filename):
+    """
+    Reads the vocabularies of a model file and memory-maps its table.
+    """
+    with open(filename, 'rb') as model_in:
+        (magic, iterations, num_f, num_e, num_pairs,
+         f_len, e_len) = HEADER.unpack(model_in.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not an IBM Model 1 file' % filename)
+        f_vocab = model_in.read(f_len).split('\n') if num_f else []
+        e_vocab = model_in.read(e_len).split('\n') if num_e else []
+
+    offset = HEADER.size + f_len + e_len
+    offset += -offset % 8
+    keys = np.memmap(filename, dtype='<i8', mode='r', offset=offset,
+                     shape=(num_pairs,))
+    probs = np.memmap(filename, dtype='<f8', mode='r',
+                      offset=offset + 8 * num_pairs, shape=(num_pairs,))
+    return model(f_vocab, e_vocab, trans_table(keys, probs, num_e), iterations)
+
+
+def save_dict(filename, p_e_f, iterations):
+    """
+    Writes the dictionary table of ibm_model1.run_iterations as a model file.
+    """
+    f_vocab = set()
+    e_vocab = set()
+    for (f_j, e_i) in p_e_f:
+        f_vocab.add(f_j)
+        e_vocab.add(e_i)
+    f_vocab.discard(NULL)
+    f_vocab = [NULL] + sorted(f_vocab)
+    e_vocab = sorted(e_vocab)
+    f_index = dict((f_j, n) for (n, f_j) in enumerate(f_vocab))
+    e_index = dict((e_i, n) for (n, e_i) in enumerate(e_vocab))
+
+    keys = np.fromiter((f_index[f_j] * len(e_vocab) + e_index[e_i]
+                        for (f_j, e_i) in p_e_f),
+                       dtype=np.int64, count=len(p_e_f))
+    probs = np.fromiter(p_e_f.itervalues(), dtype=np.float64,
+                        count=len(p_e_f))
+    order = keys.argsort()
+    table = trans_table(keys[order], probs[order], len(e_vocab))
+    save_model(filename, f_vocab, e_vocab, table, iterations)
+
+
+def load_dict(filename):
+    """
+    Reads a model file back into the dictionary table of
+    ibm_model1.run_iterations. Returns (p_e_f, iterations).
+    """
+    (f_vocab, e_vocab, table, iterations) = load_model(filename)
+    num_e = table.num_e
+    p_e_f = defaultdict(float)
+    for (key, prob) in zip(table.keys.tolist(), table.probs.tolist()):
+        p_e_f[(f_vocab[key // num_e], e_vocab[key % num_e])] = prob
+    return (p_e_f, iterations)
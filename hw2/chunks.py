@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Counting the chunks shared by a hypothesis and a reference.
+#
+# A chunk is a sequence of adjacent unigrams. We repeatedly find the longest
+# chunk shared by hwords and rwords and remove it from hwords, until there are
+# no more shared chunks. We only remove from the hwords sequence. This is
+# because each unigram in the hypothesis can map to at most one unigram in the
+# reference. Thus, once we have mapped a chunk from the hypothesis, that chunk
+# can no longer map. However, a chunk in the reference can cover two separate
+# chunks in the hypothesis.
+#
+# Run this file to check that get_num_chunks and lcs_num_chunks agree:
+#   ./chunks.py [-x data/en-cs.pairs]
+
+import argparse
+import random
+import sys
+from collections import defaultdict
+import lcs
+
+
+def lcs_num_chunks(hwords, rwords):
+    """
+    The reference implementation, which runs lcs.LCS again after every chunk
+    that it removes. Returns (number of chunks, number of unigrams in them).
+    """
+    num_chunks = 0
+    num_grams = 0
+    (seq, start, end) = lcs.LCS(hwords, rwords)
+    while seq != []:
+        num_chunks += 1
+        num_grams += len(seq)
+        hwords = hwords[:start] + hwords[end:]
+        (seq, start, end) = lcs.LCS(hwords, rwords)
+    return (num_chunks, num_grams)
+
+
+def get_num_chunks(hwords, rwords):
+    """
+    Computes the same counts as lcs_num_chunks from a single alignment pass.
+
+    runs[x] maps every reference position y where rwords[y] == hwords[x] to the
+    length of the common substring ending at hwords[x] and rwords[y]. Only
+    positions that match are stored, using an index of the reference words'
+    positions. When a chunk is removed, the only runs that change are those
+    right after it that reach back across the cut, so they are patched in
+    place instead of being recomputed.
+    """
+    positions = defaultdict(list)
+    for (y, word) in enumerate(rwords):
+        positions[word].append(y)
+
+    runs = []
+    prev = {}
+    for word in hwords:
+        cur = {}
+        for y in positions.get(word, ()):
+            cur[y] = prev.get(y - 1, 0) + 1
+        runs.append(cur)
+        prev = cur
+
+    num_chunks = 0
+    num_grams = 0
+    while True:
+        # Like lcs.LCS, we take the earliest longest chunk of the hypothesis.
+        longest = 0
+        x_longest = 0
+        for (x, row) in enumerate(runs):
+            if row:
+                row_longest = max(row.itervalues())
+                if row_longest > longest:
+                    (longest, x_longest) = (row_longest, x)
+        if longest == 0:
+            break
+        num_chunks += 1
+        num_grams += longest
+
+        start = x_longest + 1 - longest
+        del runs[start:x_longest + 1]
+        before = runs[start - 1] if start > 0 else {}
+
+        # A run at the k-th position after the cut changes only if it covers all
+        # k positions. Its new length is k plus the run of the word before the
+        # cut. Once no run reaches the cut, none of the later ones can either.
+        k = 1
+        for x in xrange(start, len(runs)):
+            row = runs[x]
+            reaching = [y for (y, run) in row.iteritems() if run >= k]
+            if not reaching:
+                break
+            for y in reaching:
+                row[y] = k + before.get(y - k, 0)
+            k += 1
+
+    return (num_chunks, num_grams)
+
+
+def check_pair(hwords, rwords):
+    expected = lcs_num_chunks(hwords, rwords)
+    actual = get_num_chunks(hwords, rwords)
+    if expected != actual:
+        sys.stderr.write('MISMATCH: %s vs %s\n  hyp: %s\n  ref: %s\n' %
+                         (expected, actual, ' '.join(hwords), ' '.join(rwords)))
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(prog='chunks')
+    argparser.add_argument('-x', '--pairs', dest='pairs', default='data/en-cs.pairs', help='Reference-Hypothesis pairs')
+    argparser.add_argument('-r', '--random', dest='random', default=10000, type=int, help='Number of random word sequences to check')
+    args = argparser.parse_args()
+
+    mismatches = 0
+    checked = 0
+    for ref_hyp in open(args.pairs):
+        ref, hyp = ref_hyp.rstrip().split(' ||| ')
+        hwords = hyp.lower().split()
+        rwords = ref.lower().split()
+        for (h, r) in [(hwords, rwords),
+                       ([w[:5] for w in hwords], [w[:5] for w in rwords])]:
+            mismatches += not check_pair(h, r)
+            checked += 1
+
+    # Small vocabularies give many repeated words and chunks that join up
+    # after a removal.
+    rand = random.Random(0)
+    for _ in xrange(args.random):
+        vocab = 'abcdefg'[:rand.randint(1, 7)]
+        h = [rand.choice(vocab) for _ in xrange(rand.randint(0, 15))]
+        r = [rand.choice(vocab) for _ in xrange(rand.randint(0, 15))]
+        mismatches += not check_pair(h, r)
+        checked += 1
+
+    sys.stderr.write('Checked %d pairs, %d mismatches.\n' % (checked, mismatches))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,90 @@
+# A binary, columnar store for the features of (ref,hyp) pairs.
+#
+# The file has a header with the number of pairs and the feature names,
+# followed by a dense float32 matrix with one row per pair, in the order of the
+# pairs file:
+#   magic, number of rows, number of features, byte length of the names
+#   the feature names, newline separated, in column order
+#   padding up to a multiple of 8 bytes
+#   rows * features float32 values, row by row
+# read_features memory-maps the matrix, so the tools that share a feature file
+# do not parse it.
+
+import struct
+import numpy as np
+
+MAGIC = 'FEATS001'
+HEADER = struct.Struct('<8sQII')
+
+
+class FeatureWriter(object):
+    """
+    Writes feature maps one row at a time. The feature names are taken from
+    the first row; features missing from a later row are stored as 0.
+    """
+    def __init__(self, filename):
+        self.out = open(filename, 'wb')
+        self.names = None
+        self.num_rows = 0
+
+    def write(self, fmap):
+        if self.names is None:
+            self.names = sorted(fmap.keys())
+            self.write_header()
+        row = np.array([fmap.get(name, 0.0) for name in self.names],
+                       dtype='<f4')
+        self.out.write(row.tostring())
+        self.num_rows += 1
+
+    def write_header(self):
+        names = '\n'.join(self.names)
+        self.out.write(HEADER.pack(MAGIC, self.num_rows, len(self.names),
+                                   len(names)))
+        self.out.write(names)
+        self.out.write('\0' * (-(HEADER.size + len(names)) % 8))
+
+    def close(self):
+        # The number of rows is only known at the end, so the header is
+        # written again once all of the rows are in.
+        if self.names is None:
+            self.names = []
+            self.write_header()
+        self.out.seek(0)
+        self.write_header()
+        self.out.close()
+
+
+def write_features(filename, fmaps):
+    writer = FeatureWriter(filename)
+    for fmap in fmaps:
+        writer.write(fmap)
+    writer.close()
+
+
+def read_features(filename):
+    """
+    Returns (names, matrix), where matrix is a memory-mapped float32 array with
+    one row per pair and one column per name.
+    """
+    with open(filename, 'rb') as features:
+        (magic, num_rows, num_feats, names_len) = HEADER.unpack(
+            features.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a binary feature file' % filename)
+        names = features.read(names_len).split('\n') if num_feats else []
+
+    offset = HEADER.size + names_len
+    offset += -offset % 8
+    if num_rows == 0 or num_feats == 0:
+        return (names, np.zeros((num_rows, num_feats), dtype=np.float32))
+    matrix = np.memmap(filename, dtype='<f4', mode='r', offset=offset,
+                       shape=(num_rows, num_feats))
+    return (names, matrix)
+
+
+def weight_vector(names, weights):
+    """
+    Lines a dict of feature weights up with the feature columns. Features
+    without a weight get 0.
+    """
+    return np.array([weights.get(name, 0.0) for name in names])
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # Simple translation model and language model data structures
+import hashlib
+import struct
 import sys
 from collections import namedtuple
+import numpy as np
 
 # A translation model is a dictionary where keys are tuples of French words
 # and values are lists of (english, logprob) named tuples. For instance,
@@ -10,9 +13,15 @@ from collections import namedtuple
 #     phrase(english='what has', logprob=-0.301030009985), 
 #     phrase(english='what has been', logprob=-0.301030009985)]
 # k is a pruning parameter: only the top k translations are kept for each f.
+#
+# If filename was compiled by ./compile-tm, TM returns a PhraseTable instead,
+# which reads the translations of each French phrase from the file when they
+# are first looked up.
 phrase = namedtuple("phrase", "english, logprob")
 def TM(filename, k):
     sys.stderr.write("Reading translation model from %s...\n" % (filename,))
+    if is_compiled_tm(filename):
+        return PhraseTable(filename, k)
     tm = {}
     for line in open(filename).readlines():
         (f, e, logprob) = line.strip().split(" ||| ")
@@ -22,6 +31,91 @@ def TM(filename, k):
         del tm[f][k:] 
     return tm
 
+# A compiled phrase table file holds:
+#   header: magic, the number of French phrases, and the k it was pruned to
+#   the sorted uint64 hashes of the French phrases
+#   the uint64 offsets of their entries in the text that follows, plus its end
+#   the entries, each a line with the French phrase followed by a line
+#   "english\tlogprob" for each of its translations, best first
+TM_MAGIC = "PHRASES1"
+TM_HEADER = struct.Struct("<8sQQ")
+
+def is_compiled_tm(filename):
+    with open(filename, "rb") as tm_in:
+        return tm_in.read(len(TM_MAGIC)) == TM_MAGIC
+
+def phrase_hash(f):
+    return int(hashlib.md5(" ".join(f)).hexdigest()[:16], 16)
+
+# Writes a compiled phrase table file from a dictionary like the one returned
+# by TM(filename, k).
+def compile_tm(tm, k, filename):
+    entries = sorted((phrase_hash(f), f) for f in tm)
+    offsets = [0]
+    with open(filename, "wb") as out:
+        out.write(TM_HEADER.pack(TM_MAGIC, len(entries), k))
+        out.write(np.array([h for (h, f) in entries], dtype="<u8").tostring())
+        # The offsets are only known once the entries are written
+        out.seek(TM_HEADER.size + 16 * len(entries) + 8)
+        for (h, f) in entries:
+            out.write(" ".join(f) + "\n")
+            for e in tm[f]:
+                out.write("%s\t%r\n" % (e.english, e.logprob))
+            offsets.append(out.tell() - TM_HEADER.size - 16 * len(entries) - 8)
+        out.seek(TM_HEADER.size + 8 * len(entries))
+        out.write(np.array(offsets, dtype="<u8").tostring())
+
+# The phrases of a compiled phrase table, which are looked up by the hash of
+# the French phrase. Like the dictionary returned by TM, it maps tuples of
+# French words to lists of phrases, of which only the top k are kept. Entries
+# are cached once they have been read.
+class PhraseTable:
+    def __init__(self, filename, k):
+        with open(filename, "rb") as tm_in:
+            (magic, size, self.compiled_k) = TM_HEADER.unpack(tm_in.read(TM_HEADER.size))
+        self.k = k
+        offset = TM_HEADER.size
+        self.hashes = np.memmap(filename, dtype="<u8", mode="r", offset=offset, shape=(size,)).view(np.ndarray) if size else np.zeros(0, dtype="<u8")
+        offset += 8 * size
+        self.offsets = np.memmap(filename, dtype="<u8", mode="r", offset=offset, shape=(size + 1,)).view(np.ndarray)
+        offset += 8 * (size + 1)
+        self.text = np.memmap(filename, dtype=np.uint8, mode="r", offset=offset).view(np.ndarray) if self.offsets[-1] else np.zeros(0, dtype=np.uint8)
+        self.cache = {}
+
+    def get(self, f, default=None):
+        if f not in self.cache:
+            self.cache[f] = self.read_phrases(f)
+        phrases = self.cache[f]
+        return default if phrases is None else phrases
+
+    # The top k phrases of f, or None if f is not in the table
+    def read_phrases(self, f):
+        h = np.uint64(phrase_hash(f))
+        source = " ".join(f)
+        # Different phrases with the same hash are next to each other
+        for i in xrange(self.hashes.searchsorted(h), self.hashes.searchsorted(h, side="right")):
+            lines = self.text[self.offsets.item(i):self.offsets.item(i + 1)].tostring().split("\n")
+            if lines[0] == source:
+                phrases = []
+                for line in lines[1:self.k + 1]:
+                    if line:
+                        (e, logprob) = line.split("\t")
+                        phrases.append(phrase(e, float(logprob)))
+                return phrases
+        return None
+
+    def __contains__(self, f):
+        return self.get(f) is not None
+
+    def __getitem__(self, f):
+        phrases = self.get(f)
+        if phrases is None:
+            raise KeyError(f)
+        return phrases
+
+    def __len__(self):
+        return len(self.hashes)
+
 # # A language model scores sequences of English words, and must account
 # # for both beginning and end of each sequence. Example API usage:
 # lm = models.LM(filename)
@@ -32,30 +126,163 @@ def TM(filename, k):
 #     (lm_state, word_logprob) = lm.score(lm_state, word)
 #     logprob += word_logprob
 # logprob += lm.end(lm_state) # transition to </s>, can also use lm.score(lm_state, "</s>")[1]
+#
+# A language model can also be read from a compiled file written by
+# ./compile-lm, which LM recognizes by its magic. Its n-grams are memory-mapped
+# from the file rather than parsed, so it loads in milliseconds.
 ngram_stats = namedtuple("ngram_stats", "logprob, backoff")
 class LM:
-    def __init__(self, filename):
+    def __init__(self, filename, cache_size=1000000):
         sys.stderr.write("Reading language model from %s...\n" % (filename,))
-        self.table = {}
-        for line in open(filename):
-            entry = line.strip().split("\t")
-            if len(entry) > 1 and entry[0] != "ngram":
-                (logprob, ngram, backoff) = (float(entry[0]), tuple(entry[1].split()), float(entry[2] if len(entry)==3 else 0.0))
-                self.table[ngram] = ngram_stats(logprob, backoff)
+        if is_compiled_lm(filename):
+            self.table = NgramTable(filename)
+        else:
+            self.table = read_arpa(filename)
+        # Scores of (state, word) are cached in two generations: new entries
+        # go in recent, and when it is full it replaces older. Entries found
+        # in older are moved back to recent, so the cache keeps at most
+        # cache_size of the most recently used scores.
+        self.cache_size = max(cache_size // 2, 1)
+        self.recent = {}
+        self.older = {}
 
     def begin(self):
         return ("<s>",)
 
     def score(self, state, word):
+        key = (state, word)
+        result = self.recent.get(key)
+        if result is None:
+            result = self.older.get(key)
+            if result is None:
+                result = self.score_uncached(state, word)
+            if len(self.recent) >= self.cache_size:
+                self.older = self.recent
+                self.recent = {}
+            self.recent[key] = result
+        return result
+
+    def score_uncached(self, state, word):
         ngram = state + (word,)
         score = 0.0
         while len(ngram)> 0:
-            if ngram in self.table:
-                return (ngram[-2:], score + self.table[ngram].logprob)
+            stats = self.table.get(ngram)
+            if stats is not None:
+                return (ngram[-2:], score + stats.logprob)
             else: #backoff
                 score += self.table[ngram[:-1]].backoff if len(ngram) > 1 else 0.0 
                 ngram = ngram[1:]
         return ((), score + self.table[("<unk>",)].logprob)
+
+    # Scores a sequence of words, adding the score of each one to logprob in
+    # turn. Returns the state after the last word and the new logprob.
+    def score_phrase(self, state, words, logprob=0.0):
+        for word in words:
+            (state, word_logprob) = self.score(state, word)
+            logprob += word_logprob
+        return (state, logprob)
         
     def end(self, state):
         return self.score(state, "</s>")[1]
+
+# Reads a language model text file into a dictionary from n-gram tuples to
+# their ngram_stats.
+def read_arpa(filename):
+    table = {}
+    for line in open(filename):
+        entry = line.strip().split("\t")
+        if len(entry) > 1 and entry[0] != "ngram":
+            (logprob, ngram, backoff) = (float(entry[0]), tuple(entry[1].split()), float(entry[2] if len(entry)==3 else 0.0))
+            table[ngram] = ngram_stats(logprob, backoff)
+    return table
+
+# A compiled language model file holds:
+#   header: magic, order, vocabulary size and byte length of the vocabulary
+#   the number of n-grams of each order, 1 to order
+#   the vocabulary, newline separated, sorted
+#   padding up to a multiple of 8 bytes
+#   for each order n: the sorted int64 keys of the n-grams, where the key of
+#   (w_1, ..., w_n) is the number with digits id(w_1) ... id(w_n) in base
+#   vocabulary size, then their float64 logprobs and backoffs
+LM_MAGIC = "NGRAMLM1"
+LM_HEADER = struct.Struct("<8sIIQ")
+
+def is_compiled_lm(filename):
+    with open(filename, "rb") as lm_in:
+        return lm_in.read(len(LM_MAGIC)) == LM_MAGIC
+
+# Writes a compiled language model file from a dictionary like the one
+# returned by read_arpa.
+def compile_lm(table, filename):
+    vocab = sorted(set(word for ngram in table for word in ngram))
+    ids = dict((word, n) for (n, word) in enumerate(vocab))
+    order = max([len(ngram) for ngram in table] or [0])
+    if len(vocab) ** order >= 2 ** 63:
+        raise ValueError("%d words are too many for %d-gram keys" % (len(vocab), order))
+
+    by_order = [[] for _ in xrange(order)]
+    for (ngram, stats) in table.iteritems():
+        key = 0
+        for word in ngram:
+            key = key * len(vocab) + ids[word]
+        by_order[len(ngram) - 1].append((key, stats.logprob, stats.backoff))
+
+    words = "\n".join(vocab)
+    with open(filename, "wb") as out:
+        out.write(LM_HEADER.pack(LM_MAGIC, order, len(vocab), len(words)))
+        for entries in by_order:
+            out.write(struct.pack("<Q", len(entries)))
+        out.write(words)
+        out.write("\0" * (-(LM_HEADER.size + 8 * order + len(words)) % 8))
+        for entries in by_order:
+            entries.sort()
+            out.write(np.array([e[0] for e in entries], dtype="<i8").tostring())
+            out.write(np.array([e[1] for e in entries], dtype="<f8").tostring())
+            out.write(np.array([e[2] for e in entries], dtype="<f8").tostring())
+
+# The n-grams of a compiled language model. Like the dictionary of read_arpa,
+# it is indexed by tuples of words and returns ngram_stats.
+class NgramTable:
+    def __init__(self, filename):
+        with open(filename, "rb") as lm_in:
+            (magic, order, vocab_size, words_len) = LM_HEADER.unpack(lm_in.read(LM_HEADER.size))
+            counts = struct.unpack("<%dQ" % order, lm_in.read(8 * order))
+            vocab = lm_in.read(words_len).split("\n") if vocab_size else []
+        self.ids = dict((word, n) for (n, word) in enumerate(vocab))
+        self.vocab_size = vocab_size
+
+        offset = LM_HEADER.size + 8 * order + words_len
+        offset += -offset % 8
+        self.keys = []
+        self.logprobs = []
+        self.backoffs = []
+        for count in counts:
+            for (arrays, dtype) in ((self.keys, "<i8"), (self.logprobs, "<f8"), (self.backoffs, "<f8")):
+                # Plain array views of the memmaps are faster to index
+                arrays.append(np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(count,)).view(np.ndarray) if count else np.zeros(0, dtype=dtype))
+                offset += 8 * count
+
+    def get(self, ngram, default=None):
+        if not 0 < len(ngram) <= len(self.keys):
+            return default
+        key = 0
+        for word in ngram:
+            n = self.ids.get(word)
+            if n is None:
+                return default
+            key = key * self.vocab_size + n
+        n = len(ngram) - 1
+        keys = self.keys[n]
+        i = keys.searchsorted(key)
+        if i == len(keys) or keys.item(i) != key:
+            return default
+        return ngram_stats(self.logprobs[n].item(i), self.backoffs[n].item(i))
+
+    def __contains__(self, ngram):
+        return self.get(ngram) is not None
+
+    def __getitem__(self, ngram):
+        stats = self.get(ngram)
+        if stats is None:
+            raise KeyError(ngram)
+        return stats
@@ -1,5 +1,6 @@
 import math
 from collections import Counter
+import numpy as np
 
 # written by Adam Lopez
 
@@ -25,3 +26,54 @@ def bleu(stats):
   log_bleu_prec = sum([math.log(float(x)/y) for x,y in zip(stats[2::2],stats[3::2])]) / 4.
   return math.exp(min([0, 1-float(r)/c]) + log_bleu_prec)
 
+
+# The n-gram counts of a sentence, for n = 1 to 4
+def ngram_counts(sentence):
+  return [Counter([tuple(sentence[i:i+n]) for i in xrange(len(sentence)+1-n)]) for n in xrange(1,5)]
+
+# The n-gram counts and the length of a reference, which bleu_stats_batch
+# can take as ref_stats so that they are shared by several calls
+def reference_stats(reference):
+  return (ngram_counts(reference), len(reference))
+
+# Collect the statistics of bleu_stats for many hypotheses of one reference,
+# such as a k-best list, counting the reference n-grams only once. Returns an
+# integer array with one row of 10 statistics for each hypothesis.
+def bleu_stats_batch(hypotheses, reference, ref_stats=None):
+  (r_ngrams, r_len) = ref_stats or reference_stats(reference)
+  stats = np.zeros((len(hypotheses), 10), dtype=np.int64)
+  stats[:,1] = r_len
+  for (k, hypothesis) in enumerate(hypotheses):
+    row = stats[k]
+    row[0] = len(hypothesis)
+    for n in xrange(1,5):
+      # Each hypothesis n-gram matches one of the remaining reference
+      # n-grams, which clips the matches like (s_ngrams & r_ngrams)
+      remaining = dict(r_ngrams[n-1])
+      matches = 0
+      for ngram in zip(*[hypothesis[i:] for i in xrange(n)]):
+        count = remaining.get(ngram)
+        if count:
+          matches += 1
+          remaining[ngram] = count - 1
+      row[2*n] = matches
+      row[2*n+1] = max(len(hypothesis)+1-n, 0)
+  return stats
+
+# Collect the statistics of a whole corpus, with one row for each
+# hypothesis/reference pair. Summing the rows gives the corpus statistics.
+def corpus_bleu_stats(hypotheses, references):
+  stats = np.zeros((len(hypotheses), 10), dtype=np.int64)
+  for (k, (hypothesis, reference)) in enumerate(zip(hypotheses, references)):
+    stats[k] = bleu_stats_batch([hypothesis], reference)[0]
+  return stats
+
+# Compute BLEU from each row of an array of statistics, like bleu does for a
+# single list of them. Rows with a zero statistic score 0.
+def bleu_batch(stats):
+  stats = np.asarray(stats, dtype=np.float64)
+  nonzero = (stats != 0).all(axis=-1)
+  safe = np.where(nonzero[...,np.newaxis], stats, 1.0)
+  (c, r) = (safe[...,0], safe[...,1])
+  log_bleu_prec = np.log(safe[...,2::2] / safe[...,3::2]).sum(axis=-1) / 4.
+  return np.where(nonzero, np.exp(np.minimum(0, 1 - r / c) + log_bleu_prec), 0.0)
@@ -1,32 +1,40 @@
-import subprocess
+import optparse
+import meteor
 
-def new_ref(outfilename):
-    all_hyps = [pair.split(' ||| ')[1] for pair in open('data/dev.100best')]
-    all_refs = [ref for ref in open('data/dev.ref')]
+def parse_options():
+    optparser = optparse.OptionParser()
+    optparser.add_option("-k", "--kbest-list", dest="input_list",
+                         default="data/dev.100best",
+                         help="100-best translation lists")
+    optparser.add_option("-r", "--reference", dest="reference",
+                         default="data/dev.ref",
+                         help="Target language reference sentences")
+    optparser.add_option("-b", "--backend", dest="backend", default="auto",
+                         help="METEOR backend: java, approx or auto")
+    optparser.add_option("-j", "--jar", dest="jar", default=meteor.METEOR_JAR,
+                         help="METEOR jar for the java backend")
+    optparser.add_option("-c", "--cache", dest="cache", default=None,
+                         help="File to cache the scores of (hyp, ref) pairs in")
+    (opts, _) = optparser.parse_args()
+    return opts
+
+# Pairs each hypothesis of the k-best lists with the reference of its
+# sentence.
+def kbest_pairs(kbest_filename, ref_filename):
+    all_hyps = [pair.split(' ||| ')[1] for pair in open(kbest_filename)]
+    all_refs = [ref for ref in open(ref_filename)]
     num_sents = len(all_hyps) / 100
-    outfile = open(outfilename, 'w')
+    pairs = []
     for s in xrange(0, num_sents):
         hyps_for_one_sent = all_hyps[s * 100:s * 100 + 100]
         ref = all_refs[s]
         for hyp in hyps_for_one_sent:
-            outfile.write(ref)
-    outfile.close()
-
-def new_hyps(outfilename):
-    all_hyps = [pair.split(' ||| ')[1] for pair in open('data/dev.100best')]
-    outfile = open(outfilename, 'w')
-    for hyp in all_hyps:
-        outfile.write(hyp + '\n')
-    outfile.close()
-
-def run_meteor(hyp_filename, ref_filename):
-    meteor_jar = './meteor-1.4/meteor-1.4.jar'
-    shell_command = ['java', '-Xmx1G', '-jar ' + meteor_jar,
-                     hyp_filename, ref_filename]
-    meteor_stdout = subprocess.check_output(' '.join(shell_command), shell=True)
-    print meteor_stdout
+            pairs.append((hyp, ref))
+    return pairs
 
 if __name__ == '__main__':
-    new_ref('data/dev.ref.new')
-    new_hyps('data/dev.100best.sents')
-    run_meteor('data/dev.100best.sents', 'data/dev.ref.new')
+    opts = parse_options()
+    scorer = meteor.scorer(opts.backend, opts.jar, opts.cache)
+    for score in scorer.score(kbest_pairs(opts.input_list, opts.reference)):
+        print repr(score)
+    scorer.close()
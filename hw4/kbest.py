@@ -0,0 +1,124 @@
+"""
+Parsed k-best lists.
+
+A k-best file has one hypothesis per line:
+    id ||| hypothesis ||| name1=value1 name2=value2 ...
+and the hypotheses of each source sentence are on consecutive lines with the
+same id. read_kbest parses the file once into a feature matrix with one row
+per feature and one column per hypothesis, and the offsets of each sentence's
+columns, so that scoring every hypothesis is a single matrix-vector product.
+"""
+
+import os
+from collections import namedtuple
+import numpy as np
+
+# A parsed k-best list.
+#   hyps: the hypotheses, in file order
+#   feat_names: the names of the rows of features
+#   features: a float64 array of shape (len(feat_names), len(hyps))
+#   starts: the index in hyps of the first hypothesis of each sentence,
+#           followed by len(hyps)
+kbest_list = namedtuple('kbest_list', 'hyps, feat_names, features, starts')
+
+
+def read_kbest(filename, extra_feats=None):
+    """
+    Parses a k-best file. The feature names are taken from the first line.
+
+    extra_feats is an optional (names, function) pair, where function maps a
+    hypothesis to the values of the named features that are computed rather
+    than read, like pro.extra_feat_names() and pro.add_feats.
+    """
+    (extra_names, extra_values) = extra_feats or ([], None)
+    hyps = []
+    starts = []
+    feat_names = None
+    values = []
+    prev_id = None
+    for line in open(filename):
+        (sent_id, hyp, feats) = line.split(' ||| ')
+        if sent_id != prev_id:
+            starts.append(len(hyps))
+            prev_id = sent_id
+        pairs = [feat.split('=') for feat in feats.split(' ')]
+        if feat_names is None:
+            feat_names = [k for (k, v) in pairs] + list(extra_names)
+        row = [float(v) for (k, v) in pairs]
+        if extra_values is not None:
+            row += extra_values(hyp)
+        hyps.append(hyp)
+        values.append(row)
+    starts.append(len(hyps))
+
+    feat_names = feat_names or list(extra_names)
+    features = np.array(values, dtype=np.float64).reshape(len(hyps),
+                                                          len(feat_names)).T
+    return kbest_list(hyps, feat_names,
+                      np.ascontiguousarray(features),
+                      np.array(starts, dtype=np.int64))
+
+
+def load_kbest(filename, cache=None, extra_feats=None):
+    """
+    Like read_kbest, but if cache is given, the parsed list is saved there as
+    a .npz file and read back from it by later calls, as long as the k-best
+    file and the extra feature names have not changed.
+    """
+    stat = os.stat(filename)
+    source = '%s %d %d' % (os.path.abspath(filename), stat.st_size,
+                           int(stat.st_mtime))
+    extra_names = list(extra_feats[0]) if extra_feats else []
+    if cache is not None and os.path.exists(cache):
+        saved = np.load(cache)
+        if (str(saved['source']) == source and
+                saved['extra_names'].tolist() == extra_names):
+            return kbest_list(saved['hyps'].tolist(),
+                              saved['feat_names'].tolist(),
+                              saved['features'], saved['starts'])
+
+    kbest = read_kbest(filename, extra_feats)
+    if cache is not None:
+        # np.savez adds .npz to names without it, so write through a file
+        with open(cache, 'wb') as out:
+            np.savez(out, source=np.array(source),
+                     extra_names=np.array(extra_names, dtype=str),
+                     hyps=np.array(kbest.hyps, dtype=str),
+                     feat_names=np.array(kbest.feat_names, dtype=str),
+                     features=kbest.features, starts=kbest.starts)
+    return kbest
+
+
+def weight_vector(kbest, weights):
+    """
+    Lines a dict of feature weights up with the rows of kbest.features.
+    """
+    return np.array([weights[name] for name in kbest.feat_names],
+                    dtype=np.float64)
+
+
+def scores(kbest, weights):
+    """
+    The score of every hypothesis under a dict of feature weights.
+    """
+    return weight_vector(kbest, weights).dot(kbest.features)
+
+
+def best_indexes(kbest, weights):
+    """
+    Returns the index in kbest.hyps of the best scoring hypothesis of each
+    sentence. Ties go to the hypothesis that comes first.
+    """
+    hyp_scores = scores(kbest, weights)
+    sents = np.repeat(np.arange(len(kbest.starts) - 1), np.diff(kbest.starts))
+    # Sorting by sentence, then by descending score, then by position puts
+    # the best hypothesis of each sentence at the sentence's start.
+    order = np.lexsort((np.arange(len(hyp_scores)), -hyp_scores, sents))
+    return order[kbest.starts[:-1]]
+
+
+def best_hypotheses(kbest, weights):
+    """
+    The best scoring hypothesis of each sentence.
+    """
+    return [kbest.hyps[i] for i in best_indexes(kbest, weights).tolist()]
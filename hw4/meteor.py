@@ -0,0 +1,195 @@
+"""
+METEOR scoring of hypothesis/reference pairs.
+
+Every scorer has the same interface, score(pairs), which returns the METEOR
+score of each (hyp, ref) pair. There are two backends:
+    JavaMeteor keeps one METEOR process running in -stdio mode and sends it
+        the pairs in batches over a pipe, so the JVM only starts once.
+    ApproxMeteor is a pure Python approximation of METEOR, for when Java or
+        the METEOR jar is not available.
+Scores are cached by the hash of the pair, so repeated pairs, like the
+duplicates of a k-best list, are only scored once. The cache can be kept in a
+file to share it between runs. The hash includes the backend and its
+parameters, so scores of different backends never stand in for each other.
+Lines of the file that were cut off by a killed run are dropped.
+"""
+
+import hashlib
+import os
+import subprocess
+import sys
+
+METEOR_JAR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'meteor-1.4', 'meteor-1.4.jar')
+
+
+def pair_key(version, hyp, ref):
+    return hashlib.md5('%s\n%s ||| %s' % (version, hyp, ref)).hexdigest()
+
+
+def drop_partial_line(cache):
+    """
+    Truncates an open file after its last newline, so that lines appended to
+    it are not glued onto a line that was cut off.
+    """
+    cache.seek(0, os.SEEK_END)
+    end = pos = cache.tell()
+    while pos > 0:
+        step = min(pos, 4096)
+        pos -= step
+        cache.seek(pos)
+        block = cache.read(step)
+        if '\n' in block:
+            pos += block.rindex('\n') + 1
+            break
+    if pos < end:
+        cache.truncate(pos)
+
+
+class MeteorScorer(object):
+    """
+    Scores pairs through a cache. Backends implement score_batch, which
+    scores a list of pairs that are not in the cache, and pass a version that
+    names the backend and its parameters, which is part of the cache keys.
+    """
+    def __init__(self, version, cache_file=None):
+        self.version = version
+        self.cache = {}
+        self.cache_file = cache_file
+        if cache_file is not None and os.path.exists(cache_file):
+            for line in open(cache_file):
+                fields = line.split('\t')
+                if not line.endswith('\n') or len(fields) != 2:
+                    continue
+                try:
+                    self.cache[fields[0]] = float(fields[1])
+                except ValueError:
+                    continue
+            with open(cache_file, 'r+') as out:
+                drop_partial_line(out)
+
+    def score(self, pairs):
+        pairs = [(hyp.strip(), ref.strip()) for (hyp, ref) in pairs]
+        keys = [pair_key(self.version, hyp, ref) for (hyp, ref) in pairs]
+        new = {}
+        for (key, pair) in zip(keys, pairs):
+            if key not in self.cache and key not in new:
+                new[key] = pair
+        if new:
+            new_keys = new.keys()
+            new_scores = self.score_batch([new[key] for key in new_keys])
+            self.cache.update(zip(new_keys, new_scores))
+            if self.cache_file is not None:
+                with open(self.cache_file, 'a') as out:
+                    for (key, score) in zip(new_keys, new_scores):
+                        out.write('%s\t%r\n' % (key, score))
+        return [self.cache[key] for key in keys]
+
+    def score_batch(self, pairs):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JavaMeteor(MeteorScorer):
+    """
+    Scores pairs with a METEOR process that reads SCORE and EVAL requests
+    from its stdin, one per line. Requests are written batch_size at a time
+    before their answers are read, which keeps both pipes from filling up.
+    """
+    def __init__(self, jar=METEOR_JAR, language='en', batch_size=100,
+                 cache_file=None, command=None):
+        if command is None:
+            command = ['java', '-Xmx1G', '-jar', jar, '-', '-',
+                       '-l', language, '-stdio']
+        MeteorScorer.__init__(self, 'java ' + ' '.join(command), cache_file)
+        self.batch_size = batch_size
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def request(self, lines):
+        for line in lines:
+            self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+        return [self.process.stdout.readline().strip() for _ in lines]
+
+    def score_batch(self, pairs):
+        scores = []
+        for start in xrange(0, len(pairs), self.batch_size):
+            batch = pairs[start:start + self.batch_size]
+            # METEOR splits requests on |||, so it cannot appear in the text
+            stats = self.request(['SCORE ||| %s ||| %s' %
+                                  (ref.replace('|||', '| | |'),
+                                   hyp.replace('|||', '| | |'))
+                                  for (hyp, ref) in batch])
+            scores += [float(score) for score in
+                       self.request(['EVAL ||| %s' % s for s in stats])]
+        return scores
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class ApproxMeteor(MeteorScorer):
+    """
+    An approximation of METEOR with only exact matches of lowercased words:
+    the harmonic mean of precision and recall, weighted by alpha towards
+    recall, times a fragmentation penalty of gamma * (chunks / matches)^beta.
+    Each hypothesis word is aligned to an unused occurrence of it in the
+    reference, preferring the one right after the previous word's, and a
+    chunk is a run of words aligned to consecutive reference positions.
+    """
+    def __init__(self, alpha=0.9, beta=3.0, gamma=0.5, cache_file=None):
+        MeteorScorer.__init__(self, 'approx %r %r %r' % (alpha, beta, gamma),
+                              cache_file)
+        (self.alpha, self.beta, self.gamma) = (alpha, beta, gamma)
+
+    def score_batch(self, pairs):
+        return [self.score_pair(hyp.lower().split(), ref.lower().split())
+                for (hyp, ref) in pairs]
+
+    def score_pair(self, hwords, rwords):
+        positions = {}
+        for (y, word) in enumerate(rwords):
+            positions.setdefault(word, []).append(y)
+        matches = 0
+        chunks = 0
+        prev = None
+        for word in hwords:
+            free = positions.get(word)
+            if not free:
+                prev = None
+                continue
+            y = prev + 1 if prev is not None and prev + 1 in free else free[0]
+            free.remove(y)
+            if prev is None or y != prev + 1:
+                chunks += 1
+            matches += 1
+            prev = y
+        if matches == 0:
+            return 0.0
+        precision = float(matches) / len(hwords)
+        recall = float(matches) / len(rwords)
+        f_mean = (precision * recall /
+                  (self.alpha * precision + (1 - self.alpha) * recall))
+        penalty = self.gamma * (float(chunks) / matches) ** self.beta
+        return f_mean * (1 - penalty)
+
+
+def scorer(backend='auto', jar=METEOR_JAR, cache_file=None):
+    """
+    Returns a scorer for backend 'java', 'approx' or 'auto', which uses Java
+    if it and the METEOR jar are available.
+    """
+    if backend == 'auto':
+        java = any(os.access(os.path.join(path, 'java'), os.X_OK)
+                   for path in os.environ.get('PATH', '').split(os.pathsep))
+        backend = 'java' if java and os.path.exists(jar) else 'approx'
+        sys.stderr.write('Using the %s METEOR backend\n' % backend)
+    if backend == 'java':
+        return JavaMeteor(jar, cache_file=cache_file)
+    elif backend == 'approx':
+        return ApproxMeteor(cache_file=cache_file)
+    raise ValueError('unknown METEOR backend %s' % backend)
@@ -3,16 +3,24 @@ Pairwise ranking optimization.
 """
 
 import sys
-import itertools, operator, math
+import itertools, math
+import heapq
 import random
+import numpy as np
 from sklearn import linear_model
 from sklearn import svm
 import bleu
 
-def single_bleu(hyp, ref):
-    stats = [0 for i in xrange(10)]
-    stats = [sum(scores) for scores in zip(stats, bleu.bleu_stats(hyp,ref))]
-    return bleu.bleu(stats)
+# ref_stats is the optional bleu.reference_stats(ref), for scoring many
+# hypotheses of the same reference without counting its n-grams each time.
+def single_bleu(hyp, ref, ref_stats=None):
+    return bleu.bleu(bleu.bleu_stats_batch([hyp], ref, ref_stats)[0].tolist())
+
+
+# The sentence-level BLEU of every hypothesis of a k-best list, as an array.
+# The reference n-grams are only counted once.
+def kbest_bleu(hyps, ref):
+    return bleu.bleu_batch(bleu.bleu_stats_batch(hyps, ref))
 
 
 # Function to determine if we should add a value to our pair_scores list.
@@ -27,6 +35,10 @@ def should_add(x):
 # vectors, along with which pair element had a greater gold score.
 # hyps is of the form:
 #   (num, hyp, features)
+# The pairs are drawn as indexes into the list of all pairs, which is never
+# built, and only the num_ret best pairs are kept while they are scored.
+# Returns an array with a row for each difference vector, and an array of
+# their labels.
 def sampler(meteor_scores, hyps, ref, num_sample, num_ret):
     # Add the additional features here. There is a bunch of pointer and
     # reference stuff going on behind the scenes, so when we have pairs, two
@@ -34,62 +46,52 @@ def sampler(meteor_scores, hyps, ref, num_sample, num_ret):
     # anywhere else, we will update them twice.
     for hyp in hyps:
         hyp[2] = add_feats(hyp[2], hyp[1])
-    # Get all of the possible pairs between hypotheses, removing the ones that
-    # are paired with themselves.
-    all_pairs = list(itertools.combinations(hyps, 2))
-    sys.stderr.write("Done generating combinations.\n")
-    # Select num_sample random pairs and put them in a list.
-    limited_pairs = random.sample(all_pairs, min(num_sample, len(all_pairs)))
-    sys.stderr.write("Done getting pairs from combinations.\n")
-    # Compare the gold standard scores for the pairs
-    pair_scores = []
-    for pair in limited_pairs:
-        h1_score = meteor_scores[pair[0][1]]
-        h2_score = meteor_scores[pair[1][1]]
-        if should_add(h1_score - h2_score):
-            # We update the feature vectors for the two hypotheses to include
-            # features not read in, but instead computed during runtime.
-            pair_scores.append((pair[0], pair[1], abs(h1_score - h2_score)))
-    sys.stderr.write("Done making list of golden score differences.\n")
-    # Sort the list in descending order by the difference in the gold
-    # standard score.
-    pair_scores.sort(key=lambda x: -x[2])
-    sys.stderr.write("Done sorting list by golden score.\n")
-    observed_vectors = []
-    targets = []
-    # Take the top num_ret pair scores, preferring ones with the greatest gold
-    # standard difference. For each pair score, compute the difference between
-    # the feature vectors for the hypotheses in the pairs, and record whether
-    # the first pair element had a greater gold score than the second pair
-    # element.
-    for i in xrange(min(num_ret, len(pair_scores))):
-        pair_score = pair_scores[i]
-        h1_vec = pair_score[0][2]
-        h2_vec = pair_score[1][2]
-        h1_score = meteor_scores[pair_score[0][1]]
-        h2_score = meteor_scores[pair_score[1][1]]
-        gold_diff_label = math.copysign(1, h1_score - h2_score)
+    # Select num_sample random pairs, removing the ones that are paired with
+    # themselves. Pair k is the k-th pair of itertools.combinations(hyps, 2).
+    num_pairs = len(hyps) * (len(hyps) - 1) / 2
+    sample = random.sample(xrange(num_pairs), min(num_sample, num_pairs))
+    (firsts, seconds) = unrank_pairs(len(hyps), sample)
+    sys.stderr.write("Done getting random pairs.\n")
+    # Compare the gold standard scores for the pairs, and keep the num_ret
+    # pairs with the greatest difference in the gold standard score. Like a
+    # stable sort, ties go to the pair that was drawn first.
+    gold = [meteor_scores[hyp[1]] for hyp in hyps]
+    pair_scores = ((i, j, abs(gold[i] - gold[j]))
+                   for (i, j) in itertools.izip(firsts, seconds)
+                   if should_add(gold[i] - gold[j]))
+    pair_scores = heapq.nlargest(num_ret, pair_scores, key=lambda x: x[2])
+    sys.stderr.write("Done selecting pairs by golden score.\n")
+    # For each pair, compute the difference between the feature vectors for
+    # the hypotheses in the pair, and record whether the first pair element
+    # had a greater gold score than the second pair element.
+    num_feats = len(hyps[0][2]) if hyps else 0
+    observed_vectors = np.empty((2 * len(pair_scores), num_feats))
+    targets = np.empty(2 * len(pair_scores))
+    for (k, (i, j, _)) in enumerate(pair_scores):
+        gold_diff_label = math.copysign(1, gold[i] - gold[j])
         # When computing the difference between feature vectors in a pair, we
         # are computing a vector from the second pair element to the first pair
         # element.
-        observed_vectors.append(vector_func_combine(operator.sub,
-                                                    h1_vec,
-                                                    h2_vec))
-        targets.append(gold_diff_label)
+        observed_vectors[2 * k] = hyps[i][2]
+        observed_vectors[2 * k] -= hyps[j][2]
+        targets[2 * k] = gold_diff_label
         # Add the pair in the opposite direction.
-        # When computing the difference between feature vectors in a pair, we
-        # are computing a vector from the first pair element to the second pair
-        # element.
-        observed_vectors.append(vector_func_combine(operator.sub,
-                                                    h2_vec,
-                                                    h1_vec))
-        targets.append(-1 * gold_diff_label)
+        observed_vectors[2 * k + 1] = -observed_vectors[2 * k]
+        targets[2 * k + 1] = -1 * gold_diff_label
     sys.stderr.write("Done creating vector points and labels.\n")
     return observed_vectors, targets
 
 
-def vector_func_combine(oper, v1, v2):
-    return [oper(vpair[0], vpair[1]) for vpair in zip(v1, v2)]
+# Returns the hypothesis indexes (firsts, seconds) of the pairs with the given
+# indexes among the n * (n - 1) / 2 pairs of itertools.combinations(range(n), 2).
+def unrank_pairs(n, pair_indexes):
+    pair_indexes = np.asarray(pair_indexes, dtype=np.int64)
+    # Pairs starting with hypothesis i come after the n - 1, n - 2, ..., n - i
+    # pairs that start with the hypotheses before it.
+    firsts_start = np.cumsum(np.arange(n - 1, 0, -1)) - np.arange(n - 1, 0, -1)
+    firsts = np.searchsorted(firsts_start, pair_indexes, side='right') - 1
+    seconds = pair_indexes - firsts_start[firsts] + firsts + 1
+    return (firsts.tolist(), seconds.tolist())
 
 
 # We randomly choose n elements in l and put them at the start of l.
@@ -103,13 +105,11 @@ def limit_shuffle(l, n):
     return l
 
 
-def train_classifier(observed_vectors, targets):
+def new_classifier():
     # classifier = linear_model.Ridge(alpha=0.5)
     # classifier = svm.LinearSVC()
     # classifier = linear_model.LogisticRegression()
-    classifier = linear_model.SGDRegressor(alpha=1.0)
-    classifier.fit(observed_vectors, targets)
-    return classifier
+    return linear_model.SGDRegressor(alpha=1.0)
 
 
 # The order of these must match the order of the values we add from add_feats()
@@ -136,44 +136,54 @@ def is_ascii(word):
     else:
         return True
 
-def sample_and_train_classifier(hyp_train_file, train_ref_file, meteor_scores_file):
-    all_hyps = [pair.split(' ||| ') for pair in open(hyp_train_file)]
-    all_refs = [ref for ref in open(train_ref_file)]
-    all_meteor = [float(score) for score in open(meteor_scores_file)]
-    meteor_dict = {}
-    for sent_score in zip(all_hyps, all_meteor):
-        meteor_dict[sent_score[0][1]] = sent_score[1]
+# Reads the k-best lists of a training set one sentence at a time. Yields
+# (hyps, ref, meteor_scores) for each sentence, where hyps are the
+# [num, hyp, features] of its hypotheses and meteor_scores maps each
+# hypothesis to its score.
+def read_sentences(hyp_train_file, train_ref_file, meteor_scores_file):
+    lines = itertools.izip(open(hyp_train_file), open(meteor_scores_file))
+    refs = open(train_ref_file)
+    for (_, sent_lines) in itertools.groupby(lines, key=lambda x: x[0].split(' ||| ', 1)[0]):
+        hyps = []
+        meteor_scores = {}
+        for (line, score) in sent_lines:
+            hyp = line.split(' ||| ')
+            meteor_scores[hyp[1]] = float(score)
+            hyps.append(hyp)
+        yield (hyps, next(refs), meteor_scores)
+
+# The sampled pairs are used to train the classifier batch_size sentences at a
+# time, so only one batch of difference vectors is in memory at once. Like
+# SGDRegressor.fit, which makes 5 passes over its data by default, training
+# makes epochs passes over the training files, sampling new pairs each time.
+def sample_and_train_classifier(hyp_train_file, train_ref_file, meteor_scores_file, batch_size=20, epochs=5):
+    classifier = new_classifier()
     observed_vectors = []
     targets = []
-    num_sents = len(all_hyps) / 100
-    set_feat_names = False
-    feat_names = []
-    sys.stderr.write("Number of sentences = %d\n" % num_sents)
-    for s in xrange(0, num_sents):
-        hyps_for_one_sent = all_hyps[s * 100:s * 100 + 100]
-        for i, hyp in enumerate(hyps_for_one_sent):
-            feats = hyp[2]
-            split_feats = []
-            for feat in feats.split(' '):
-                (k, v) = feat.split('=')
-                if not set_feat_names:
-                    feat_names.append(k)
-                split_feats.append(float(v))
-                hyps_for_one_sent[i][2] = split_feats
-            if not set_feat_names:
-                feat_names += extra_feat_names()
-                set_feat_names = True
-        ref = all_refs[s]
-        sys.stderr.write("Sampling from sentence %d...\n" % s)
-        more_obs_vecs, more_tgts = sampler(meteor_dict, hyps_for_one_sent, ref,
-                                           5000, 50)
-        sys.stderr.write("Done sampling from sentence %d\n\n" % s)
-        observed_vectors += more_obs_vecs
-        targets += more_tgts
-    trained_clfr = train_classifier(observed_vectors, targets)
-    weight_vec = classifier_weight(trained_clfr, feat_names)
-    # print weight_vec
-    return trained_clfr
+    def train_batch():
+        if observed_vectors:
+            classifier.partial_fit(np.concatenate(observed_vectors),
+                                   np.concatenate(targets))
+        del observed_vectors[:], targets[:]
+
+    for epoch in xrange(epochs):
+        num_sents = 0
+        for (s, (hyps_for_one_sent, ref, meteor_scores)) in enumerate(
+                read_sentences(hyp_train_file, train_ref_file, meteor_scores_file)):
+            for hyp in hyps_for_one_sent:
+                hyp[2] = [float(feat.split('=')[1]) for feat in hyp[2].split(' ')]
+            sys.stderr.write("Sampling from sentence %d...\n" % s)
+            more_obs_vecs, more_tgts = sampler(meteor_scores, hyps_for_one_sent, ref,
+                                               5000, 50)
+            sys.stderr.write("Done sampling from sentence %d\n\n" % s)
+            observed_vectors.append(more_obs_vecs)
+            targets.append(more_tgts)
+            if len(observed_vectors) == batch_size:
+                train_batch()
+            num_sents += 1
+        train_batch()
+        sys.stderr.write("Number of sentences = %d\n" % num_sents)
+    return classifier
 
 def classifier_weight(classifier, feat_names):
     coef = classifier.coef_